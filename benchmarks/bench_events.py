@@ -0,0 +1,88 @@
+"""Compare the cost of triggering events as kwargs and as EventRecords.
+
+For each way of triggering, this reports the time per event and, on
+interpreters with `tracemalloc` (Python 3.9+), two allocation counts: the
+number of memory blocks still allocated per event after `iterations` events,
+from the difference between `tracemalloc` snapshots taken with the garbage
+collector disabled, and the number of bytes allocated at peak while
+triggering one event.
+
+Usage: python benchmarks/bench_events.py [hooks] [event names] [iterations]
+
+"""
+
+import gc
+import sys
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import panglery
+
+def make_pangler(hooks, names):
+    p = panglery.Pangler()
+    def passthrough(p, foo):
+        pass
+    def doubler(p, foo):
+        return {'foo': foo * 2}
+    for i in range(hooks):
+        name = 'event%d' % (i % names,)
+        if i % 4 == 0:
+            p.subscribe(doubler, event=name, modifies=['foo'])
+        else:
+            p.subscribe(passthrough, event=name, needs=['foo'])
+    return p
+
+def peak_bytes(func):
+    func()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        func()
+        return tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+
+def blocks_per_event(func, iterations):
+    func()
+    gc.disable()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for i in range(iterations):
+            func()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+    blocks = sum(
+        stat.count_diff for stat in after.compare_to(before, 'filename'))
+    return blocks / float(iterations)
+
+def main(hooks=1000, names=10, iterations=2000):
+    p = make_pangler(hooks, names)
+    schema = panglery.EventSchema('event0', ['foo', 'bar'])
+    record = schema.record(foo=1, bar=2)
+
+    def trigger_kwargs():
+        p.trigger(event='event0', foo=1, bar=2)
+
+    def trigger_record():
+        record['foo'] = 1
+        p.trigger_record(record)
+
+    print('%d hooks, %d event names' % (hooks, names))
+    for label, func in [('kwargs', trigger_kwargs), ('record', trigger_record)]:
+        elapsed = min(timeit.repeat(func, number=iterations, repeat=3))
+        line = '%-8s %8.2f us/event' % (label, elapsed / iterations * 1e6)
+        if tracemalloc is not None and hasattr(tracemalloc, 'reset_peak'):
+            line += '  %6.2f blocks/event  %8d bytes/event at peak' % (
+                blocks_per_event(func, iterations), peak_bytes(func))
+        print(line)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
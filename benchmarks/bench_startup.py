@@ -0,0 +1,82 @@
+"""Measure the startup cost of many classes with Panglers.
+
+A synthetic module is generated with `hooks` hooks spread over classes of
+`hooks_per_class` hooks each, every class inheriting from the one before it
+in runs of `depth`. For eager and lazy subscription, this reports the time to
+execute the module (i.e. importing it from an up to date .pyc), the time to
+first trigger an event on one instance of every class, and, for lazy
+subscription, the time `Pangler.prepare` takes to do the deferred work ahead
+of time instead. Each is the best of `repeat` runs. Garbage left over from
+earlier runs is collected before each run, and the garbage collector is
+disabled while timing, so that runs don't depend on what ran before them.
+
+Usage: python benchmarks/bench_startup.py [hooks] [hooks per class] [depth]
+    [repeat]
+
+"""
+
+import gc
+import sys
+import time
+
+import panglery
+
+def make_source(hooks, hooks_per_class, depth):
+    lines = ['import panglery']
+    for i in range(hooks // hooks_per_class):
+        if i % depth:
+            base = 'Class%d' % (i - 1,)
+        else:
+            base = 'object'
+        lines.append('class Class%d(%s):' % (i, base))
+        lines.append('    hooks = panglery.Pangler()')
+        lines.append("    p = panglery.PanglerAggregate('hooks')")
+        for j in range(hooks_per_class):
+            lines.append(
+                "    @hooks.subscribe(event='event%d', modifies=['foo'],"
+                " needs=['bar'])" % (j % 5,))
+            lines.append('    def hook%d(self, p, foo, bar):' % (j,))
+            lines.append('        pass')
+    return '\n'.join(lines) + '\n'
+
+def run(code, lazy, prewarm):
+    panglery.Pangler.lazy = lazy
+    namespace = {}
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.time()
+        exec(code, namespace)
+        imported = time.time()
+        panglery.Pangler.lazy = False
+        classes = [value for name, value in sorted(namespace.items())
+            if name.startswith('Class')]
+        if prewarm:
+            for cls in classes:
+                cls.hooks.prepare()
+        prepared = time.time()
+        for instance in [cls() for cls in classes]:
+            instance.p().trigger(event='event0', foo=1, bar=2)
+        triggered = time.time()
+    finally:
+        panglery.Pangler.lazy = False
+        gc.enable()
+    return imported - start, prepared - imported, triggered - prepared
+
+def main(hooks=10000, hooks_per_class=20, depth=5, repeat=5):
+    code = compile(
+        make_source(hooks, hooks_per_class, depth), '<synthetic>', 'exec')
+    print('%d hooks, %d per class, inheritance depth %d' % (
+        hooks, hooks_per_class, depth))
+    print('%-14s %10s %10s %14s' % ('', 'import', 'prepare', 'first trigger'))
+    for label, lazy, prewarm in [
+            ('eager', False, False),
+            ('lazy', True, False),
+            ('lazy+prepare', True, True)]:
+        runs = [run(code, lazy, prewarm) for i in range(repeat)]
+        imported, prepared, triggered = [min(times) for times in zip(*runs)]
+        print('%-14s %8.1fms %8.1fms %12.1fms' % (
+            label, imported * 1e3, prepared * 1e3, triggered * 1e3))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
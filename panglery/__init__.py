@@ -1,6 +1,7 @@
 """panglery!"""
 
-from panglery.pangler import Pangler, PanglerAggregate
+from panglery.pangler import Pangler, PanglerAggregate, EventSchema
 from panglery._version import __version__, __sha__
 
-__all__ = ['Pangler', 'PanglerAggregate', '__version__', '__sha__']
+__all__ = [
+    'Pangler', 'PanglerAggregate', 'EventSchema', '__version__', '__sha__']
@@ -0,0 +1,279 @@
+"""Forwarding events between processes for panglery.
+
+An `EventPublisher` collects selected events from a Pangler and sends them in
+batches over a connection to an `EventSubscriber`, which triggers them on its
+own Pangler. Connections can be anything with the `send_bytes`, `recv_bytes`
+and `poll` methods of `multiprocessing` connections, e.g. one end of a
+`multiprocessing.Pipe()`; `SocketConnection` adapts a connected socket to
+the same interface.
+
+Batches are serialized with `pickle`, and unpickling can run arbitrary code.
+An `EventSubscriber` must only ever be connected to a trusted publisher: never
+accept connections on a socket that untrusted peers can reach.
+
+"""
+
+import select
+import struct
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+_ACK = b''
+_LENGTH = struct.Struct('!I')
+
+def _encode_batch(events):
+    """Serialize a list of event dicts.
+
+    Events with the same set of keys share one tuple of key names, and only
+    the index of that tuple and their values are stored per event.
+
+    """
+
+    shapes = {}
+    shape_keys = []
+    rows = []
+    for event in events:
+        keys = tuple(sorted(event))
+        index = shapes.get(keys)
+        if index is None:
+            index = shapes[keys] = len(shape_keys)
+            shape_keys.append(keys)
+        rows.append((index, tuple([event[key] for key in keys])))
+    return pickle.dumps((shape_keys, rows), pickle.HIGHEST_PROTOCOL)
+
+def _picklable(event):
+    try:
+        pickle.dumps(event, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return False
+    return True
+
+def _decode_batch(data):
+    shape_keys, rows = pickle.loads(data)
+    return [dict(zip(shape_keys[index], values)) for index, values in rows]
+
+class BridgeStats(object):
+    """Delivery statistics for one end of a bridge.
+
+    `events` and `batches` count what was sent or received, `bytes` counts the
+    size of the serialized batches, `acked` counts the batches acknowledged by
+    the subscriber, and `waits` counts how many times the publisher had to
+    block because too many batches were unacknowledged. `dropped` counts the
+    events the publisher couldn't serialize, and `failed` counts the batches
+    the subscriber couldn't trigger every event of.
+
+    """
+
+    def __init__(self):
+        super(BridgeStats, self).__init__()
+        self.events = 0
+        self.batches = 0
+        self.bytes = 0
+        self.acked = 0
+        self.waits = 0
+        self.dropped = 0
+        self.failed = 0
+
+class BridgeTimeout(Exception):
+    """The subscriber didn't acknowledge a batch in time."""
+
+class EventPublisher(object):
+    """The sending end of a bridge.
+
+    Events are queued until `batch_size` of them are pending, or until `flush`
+    is called. At most `max_in_flight` batches may be sent without being
+    acknowledged by the subscriber; past that, flushing blocks until the
+    subscriber catches up. Waiting for an acknowledgement takes at most
+    `ack_timeout` seconds (forever, if it's None) before raising
+    BridgeTimeout.
+
+    Events which can't be serialized are dropped when their batch is sent.
+
+    """
+
+    def __init__(self, connection, batch_size=64, max_in_flight=4,
+            ack_timeout=30):
+        super(EventPublisher, self).__init__()
+        self.connection = connection
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.ack_timeout = ack_timeout
+        self.pending = []
+        self.in_flight = 0
+        self.stats = BridgeStats()
+
+    def forward(self, pangler, needs=(), **conditions):
+        """Forward events from a Pangler.
+
+        Subscribes to `pangler` with the provided `needs` and conditions. Each
+        matching event is published with those parameters only.
+
+        """
+
+        needs = list(needs)
+        def forward_hook(*args, **parameters):
+            parameters.update(conditions)
+            self.publish(**parameters)
+        pangler.subscribe(forward_hook, needs=needs, **conditions)
+
+    def publish(self, **event):
+        """Queue an event to be sent to the subscriber."""
+
+        if not event:
+            raise ValueError("tried to publish nothing")
+        self.pending.append(event)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def _collect_acks(self, block=False):
+        if block and self.in_flight:
+            if not self.connection.poll(self.ack_timeout):
+                raise BridgeTimeout()
+        while self.in_flight and (block or self.connection.poll(0)):
+            self.connection.recv_bytes()
+            self.in_flight -= 1
+            self.stats.acked += 1
+            block = False
+
+    def flush(self):
+        """Send all of the queued events as one batch."""
+
+        self._collect_acks()
+        if not self.pending:
+            return
+        if self.in_flight >= self.max_in_flight:
+            self.stats.waits += 1
+            self._collect_acks(block=True)
+        events, self.pending = self.pending, []
+        try:
+            data = _encode_batch(events)
+        except Exception:
+            # Only serialize the events individually when the batch as a whole
+            # can't be, to find the ones to drop.
+            sendable = [event for event in events if _picklable(event)]
+            self.stats.dropped += len(events) - len(sendable)
+            if not sendable:
+                return
+            events = sendable
+            data = _encode_batch(events)
+        self.connection.send_bytes(data)
+        self.in_flight += 1
+        self.stats.events += len(events)
+        self.stats.batches += 1
+        self.stats.bytes += len(data)
+
+    def close(self):
+        """Flush, wait for every batch to be acknowledged, and close."""
+
+        try:
+            self.flush()
+            while self.in_flight:
+                self._collect_acks(block=True)
+        finally:
+            self.connection.close()
+
+class EventSubscriber(object):
+    """The receiving end of a bridge.
+
+    Each event received over `connection` is triggered on `pangler`. Batches
+    are unpickled, so `connection` must only lead to a trusted publisher.
+
+    """
+
+    def __init__(self, connection, pangler):
+        super(EventSubscriber, self).__init__()
+        self.connection = connection
+        self.pangler = pangler
+        self.stats = BridgeStats()
+
+    def receive(self, timeout=None):
+        """Receive and trigger one batch of events.
+
+        Waits at most `timeout` seconds for a batch, or forever if `timeout` is
+        None. Returns the number of events triggered.
+
+        The batch is acknowledged even if a hook raises an exception, which
+        then propagates after the rest of the batch is dropped.
+
+        """
+
+        if timeout is not None and not self.connection.poll(timeout):
+            return 0
+        return self._trigger_batch(self.connection.recv_bytes())
+
+    def _trigger_batch(self, data):
+        self.stats.batches += 1
+        self.stats.bytes += len(data)
+        triggered = 0
+        try:
+            for event in _decode_batch(data):
+                self.pangler.trigger(**event)
+                triggered += 1
+        except Exception:
+            self.stats.failed += 1
+            raise
+        finally:
+            self.stats.events += triggered
+            self.connection.send_bytes(_ACK)
+            self.stats.acked += 1
+        return triggered
+
+    def serve(self, on_error=None):
+        """Receive and trigger batches until the connection is closed.
+
+        A batch in which a hook raises an exception is counted in
+        `stats.failed`, and serving carries on with the next batch. If
+        `on_error` is passed, it's called with each such exception.
+
+        """
+
+        while True:
+            try:
+                data = self.connection.recv_bytes()
+            except EOFError:
+                return
+            try:
+                self._trigger_batch(data)
+            except Exception as e:
+                if on_error is not None:
+                    on_error(e)
+
+class SocketConnection(object):
+    """Adapt a connected stream socket to the connection interface.
+
+    Each message is sent prefixed with its length. As an EventSubscriber
+    unpickles what it receives, the socket must only be connected to a trusted
+    peer, e.g. over a Unix socket or `socket.socketpair()`.
+
+    """
+
+    def __init__(self, sock):
+        super(SocketConnection, self).__init__()
+        self.sock = sock
+
+    def send_bytes(self, data):
+        self.sock.sendall(_LENGTH.pack(len(data)) + data)
+
+    def _recv_exactly(self, size):
+        chunks = []
+        while size:
+            chunk = self.sock.recv(size)
+            if not chunk:
+                raise EOFError()
+            chunks.append(chunk)
+            size -= len(chunk)
+        return _ACK.join(chunks)
+
+    def recv_bytes(self):
+        size, = _LENGTH.unpack(self._recv_exactly(_LENGTH.size))
+        return self._recv_exactly(size)
+
+    def poll(self, timeout=0):
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        return bool(readable)
+
+    def close(self):
+        self.sock.close()
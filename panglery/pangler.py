@@ -2,11 +2,49 @@
 """
 
 import functools
+import itertools
 import warnings
 import inspect
 import weakref
+import time
 
 _DEFAULT_ID = object()
+_MISSING = object()
+_getargspec = getattr(inspect, 'getfullargspec', None) or inspect.getargspec
+# Deadlines are measured on a clock which can't jump when the system time is
+# changed, where there is one.
+_clock = getattr(time, 'monotonic', time.time)
+_versions = itertools.count()
+
+class _HookList(list):
+    """A list of hooks which knows when it was last changed.
+
+    `version` is set to a new, never before used number whenever the list is
+    changed in any way, so that anything worked out from its hooks can be
+    reused until then.
+
+    """
+
+    def __init__(self, *args):
+        super(_HookList, self).__init__(*args)
+        self.version = next(_versions)
+
+def _changing(name):
+    method = getattr(list, name)
+    def change(self, *args, **kwargs):
+        self.version = next(_versions)
+        return method(self, *args, **kwargs)
+    change.__name__ = name
+    change.__doc__ = method.__doc__
+    return change
+
+for _name in (
+        'append', 'extend', 'insert', 'remove', 'pop', 'clear', 'sort',
+        'reverse', '__setitem__', '__delitem__', '__iadd__', '__imul__',
+        '__setslice__', '__delslice__'):
+    if hasattr(list, _name):
+        setattr(_HookList, _name, _changing(_name))
+del _name
 
 class Pangler(object):
     """A pangler.
@@ -33,18 +71,50 @@ class Pangler(object):
     If a Pangler has an `id` of None, binding it will never store the bound
     Pangler.
 
+    If `lazy` is true, subscribing only records each hook, and working out what
+    the hook matches is put off until it's first needed. This makes defining
+    many hooks cheaper, e.g. when importing many classes with Panglers, at the
+    cost of the first trigger. Setting `Pangler.lazy = True` before those
+    classes are defined makes every Pangler lazy by default. `prepare` can be
+    used to do the deferred work ahead of time.
+
+    A Pangler can also be an overlay on a `base` Pangler, made with `overlay`.
+    Its `hooks` then only hold the hooks added to it in particular, which run
+    after every hook of the base.
+
+    `hooks` can be changed like any list; assigning another list to it copies
+    that list.
+
+    A Pangler's `tracer`, if not None, is told about every event triggered and
+    every hook run for it; see `panglery.tracing`. Like `lazy`, this can be
+    set for every Pangler at once as `Pangler.tracer`.
+
     """
 
     _bound_pangler_store = weakref.WeakKeyDictionary()
+    lazy = False
+    tracer = None
 
-    def __init__(self, id=_DEFAULT_ID):
+    def __init__(self, id=_DEFAULT_ID, lazy=None):
         super(Pangler, self).__init__()
         self.id = id
+        if lazy is not None:
+            self.lazy = lazy
         self.hooks = []
+        self.base = None
         self.instance = None
+        self._plans = {}
+
+    @property
+    def hooks(self):
+        return self._hooks
+
+    @hooks.setter
+    def hooks(self, hooks):
+        self._hooks = _HookList(hooks)
 
     def subscribe(self, _func=None, needs=(), returns=(), modifies=(),
-            **conditions):
+            _timeout=None, _critical=False, **conditions):
         """Add a hook to a pangler.
 
         This method can either be used as a decorator for a function or method,
@@ -55,19 +125,24 @@ class Pangler(object):
            and then pass back to the pangler.
          * `modifies` is a convenient way to specify that this hook both needs
            and returns a parameter.
+         * `_timeout` is the number of seconds this hook is expected to take.
+           When an event is triggered with a deadline, the hook is skipped if
+           less than this much time remains.
+         * `_critical`, if true, means this hook always runs, even once the
+           deadline of an event has passed.
          * The rest of the keyword arguments are parameter predicates.
 
         """
 
-        modifies = set(modifies)
-        parameters = set(needs) | modifies
-        needs = parameters | set(conditions)
-        if not needs:
+        if not (needs or modifies or conditions):
             raise ValueError("tried to hook nothing")
-        returns = set(returns) | modifies
         def deco(func):
-            self.hooks.append(_Hook(
-                func, needs, parameters, returns, conditions))
+            hook = _Hook(
+                func, needs, returns, modifies, conditions,
+                _timeout, _critical)
+            if not self.lazy:
+                hook.prepare()
+            self.hooks.append(hook)
             return func
 
         # If we were passed a function as a positional parameter, then we
@@ -82,19 +157,166 @@ class Pangler(object):
         warnings.warn("use subscribe instead of add_hook", DeprecationWarning)
         return self.subscribe(*a, **kw)
 
-    def trigger(self, **event):
+    def trigger(self, _deadline=None, _executor=None, **event):
         """Trigger an event.
 
         Event parameters are passed as keyword arguments. Passing an `event`
         argument isn't required, but generally recommended.
 
+        If `_deadline` is passed, it's the number of seconds the event is
+        allowed to take. Once that budget is spent, or once a hook's `_timeout`
+        no longer fits in what remains, non-critical hooks are skipped. If an
+        `_executor` (anything with a `submit` method, like the executors from
+        `concurrent.futures`) is also passed, those hooks are instead submitted
+        to it with a copy of the event as it was at that point. Passing an
+        `_executor` without a `_deadline` raises a ValueError. With a
+        `_deadline`, a `TriggerReport` is returned; otherwise `trigger` returns
+        None.
+
         """
 
         if not event:
             raise ValueError("tried to trigger nothing")
-        for hook in self.hooks:
-            if hook.matches(event):
-                hook.execute(self, event)
+        if _executor is not None and _deadline is None:
+            raise ValueError("an executor is only used with a deadline")
+        report = span = None
+        if _deadline is not None:
+            report = TriggerReport()
+            end = _clock() + _deadline
+        tracer = self.tracer
+        if tracer is not None:
+            span = tracer.start(event)
+        matcher = _Matcher(event)
+        for hook in self._all_hooks():
+            if not matcher.matches(hook):
+                continue
+            if (report is not None and not hook.critical
+                    and not hook.fits(end - _clock())):
+                if _executor is not None:
+                    _executor.submit(hook.execute, self, dict(event))
+                    report.deferred.append(hook.func)
+                    status = 'deferred'
+                else:
+                    report.skipped.append(hook.func)
+                    status = 'skipped'
+                if span is not None:
+                    tracer.skip(span, hook, status)
+                continue
+            if span is None:
+                result = hook.execute(self, event)
+            else:
+                result = tracer.execute(span, hook, self, event)
+            if result:
+                matcher.changed(result)
+        if span is not None:
+            tracer.finish(span)
+        return report
+
+    def trigger_iter(self, **event):
+        """Trigger an event, one hook at a time.
+
+        Returns an iterator which runs the next matching hook each time it's
+        advanced, yielding the hook function and a dict of the parameters it
+        changed (empty if it changed nothing). Hooks only run as the iterator
+        is consumed, so stopping early skips the remaining hooks entirely.
+        Deadlines and tracing aren't supported here.
+
+        """
+
+        if not event:
+            raise ValueError("tried to trigger nothing")
+        return self._iter_hooks(event)
+
+    def _iter_hooks(self, event):
+        matcher = _Matcher(event)
+        for hook in self._all_hooks():
+            if not matcher.matches(hook):
+                continue
+            result = hook.execute(self, event)
+            if result is None:
+                yield hook.func, {}
+            else:
+                matcher.changed(result)
+                yield hook.func, result
+
+    def _version(self):
+        # Changes whenever the hooks of this Pangler or of any of its bases
+        # change, so that anything worked out from them can be reused until
+        # then.
+        if self.base is None:
+            return self._hooks.version
+        return self.base._version(), self._hooks.version
+
+    def _plan(self, schema):
+        plan = [
+            step for step in (
+                hook.plan(self, schema) for hook in self._all_hooks())
+            if step is not None]
+        self._plans[schema] = self._version(), plan
+        return plan
+
+    def trigger_record(self, record):
+        """Trigger an event stored in an EventRecord.
+
+        This behaves like `trigger`, except that the event is read from and
+        written back to `record` in place. Which hooks could match events of
+        the record's schema, and where their parameters are stored, is worked
+        out the first time a schema is triggered, so this avoids building a
+        dict per event and per hook. Deadlines aren't supported here.
+
+        Hooks can only return parameters declared in the schema, other than
+        `event`. If a hook which could match declares any other `returns`, a
+        ValueError is raised before any hook runs.
+
+        """
+
+        cached = self._plans.get(record.schema)
+        if cached is not None and cached[0] == self._version():
+            plan = cached[1]
+        else:
+            plan = self._plan(record.schema)
+        values = record.values
+        for hook, needs, conditions, arguments, positional in plan:
+            for index in needs:
+                if values[index] is _MISSING:
+                    break
+            else:
+                for index, value in conditions:
+                    if not values[index] == value:
+                        break
+                else:
+                    hook.execute_record(
+                        self, record, arguments, positional)
+
+    def prepare(self, *schemas):
+        """Do the work deferred by lazy subscription ahead of time.
+
+        Works out what every hook of this Pangler matches, and resolves the
+        hooks against each of the provided EventSchemas for `trigger_record`.
+
+        """
+
+        for hook in self._all_hooks():
+            hook.prepare()
+        for schema in schemas:
+            self._plan(schema)
+
+    def _all_hooks(self):
+        if self.base is None:
+            return self.hooks
+        if not self.hooks:
+            return self.base._all_hooks()
+        return itertools.chain(self.base._all_hooks(), self.hooks)
+
+    def _empty_copy(self):
+        p = type(self)(self.id)
+        # Only copy what was set on this Pangler in particular, so that the
+        # copy still follows the class's defaults otherwise.
+        for attr in ('lazy', 'tracer'):
+            if attr in self.__dict__:
+                setattr(p, attr, self.__dict__[attr])
+        p.instance = self.instance
+        return p
 
     def clone(self):
         """Duplicate a Pangler.
@@ -105,24 +327,43 @@ class Pangler(object):
 
         """
 
-        p = type(self)(self.id)
-        p.hooks = list(self.hooks)
-        p.instance = self.instance
+        p = self._empty_copy()
+        p.hooks = self.hooks
+        p.base = self.base
+        return p
+
+    def overlay(self):
+        """Layer a new Pangler over this one.
+
+        Returns a Pangler which runs all of the hooks of this Pangler, without
+        copying them, followed by any hooks added to it later. Hooks added to
+        this Pangler later will also be run. The new Pangler will be bound to
+        the same instance and have the same `id`.
+
+        """
+
+        p = self._empty_copy()
+        p.base = self
         return p
 
     def combine(self, *others):
         """Combine other Panglers into this Pangler.
 
         Returns a copy of this Pangler with all of the hooks from the provided
-        Panglers added to it as well. The new Pangler will be bound to the same
-        instance and have the same `id`, but new hooks will not be shared with
-        this Pangler or any provided Panglers.
+        Panglers added to it as well. A hook which is reachable through more
+        than one of the Panglers is only added once. The new Pangler will be
+        bound to the same instance and have the same `id`, but new hooks will
+        not be shared with this Pangler or any provided Panglers.
 
         """
 
         p = self.clone()
+        seen = set(p._all_hooks())
         for other in others:
-            p.hooks.extend(other.hooks)
+            for hook in other._all_hooks():
+                if hook not in seen:
+                    seen.add(hook)
+                    p.hooks.append(hook)
         return p
 
     def bind(self, instance):
@@ -203,6 +444,13 @@ class PanglerAggregate(object):
         collecting panglers exposed as `self.attr_name`. The resulting pangler
         will be bound to the provided `instance`.
 
+        The panglers are only combined once per class, until the hooks of any
+        of them (or of their bases) change; each instance gets an overlay on
+        the combined pangler. The combined pangler is kept on the class, in
+        the `_pangler_aggregate_bases` attribute.
+        If any of the panglers has its own `tracer`, the first one found is
+        used for the resulting pangler.
+
         """
 
         try:
@@ -211,7 +459,6 @@ class PanglerAggregate(object):
             pass
         else:
             return p
-        p = self.pangler_factory(self.id)
         mro = inspect.getmro(owner)
         others = []
         for cls in mro:
@@ -219,7 +466,26 @@ class PanglerAggregate(object):
             if sub_p is None:
                 continue
             others.append(sub_p)
-        return p.combine(*others).stored_bind(instance)
+        versions = [sub_p._version() for sub_p in others]
+        # The cache is kept on the class itself rather than on this aggregate,
+        # as hooks can refer back to the class (e.g. with `super()`), which
+        # would keep it alive forever.
+        bases = owner.__dict__.get('_pangler_aggregate_bases')
+        if bases is None:
+            bases = {}
+            owner._pangler_aggregate_bases = bases
+        cached = bases.get(self)
+        if cached is not None and cached[:2] == (others, versions):
+            base = cached[2]
+        else:
+            base = self.pangler_factory(self.id).combine(*others)
+            bases[self] = others, versions, base
+        p = base.overlay()
+        for sub_p in others:
+            if 'tracer' in sub_p.__dict__:
+                p.tracer = sub_p.tracer
+                break
+        return p.stored_bind(instance)
 
 class InstanceDead(Exception):
     """The instance bound to a Pangler is dead.
@@ -230,13 +496,44 @@ class InstanceDead(Exception):
 
     """
 
-class _Hook(object):
-    def __init__(self, func, needs, parameters, returns, conditions):
-        super(_Hook, self).__init__()
-        self.func = func
+class TriggerReport(object):
+    """What happened to the hooks of an event triggered with a deadline.
+
+    `skipped` is a list of the hook functions which were not run because the
+    deadline was reached, and `deferred` is a list of the hook functions which
+    were submitted to the executor instead, both in the order they would have
+    run.
+
+    """
+
+    def __init__(self):
+        super(TriggerReport, self).__init__()
+        self.skipped = []
+        self.deferred = []
+
+_signatures = weakref.WeakValueDictionary()
+
+def _signature(needs, conditions):
+    """Get the shared _Signature for some needs and conditions.
+
+    Unhashable condition values can't be shared, so they get a _Signature of
+    their own.
+
+    """
+
+    try:
+        key = frozenset(needs), frozenset(conditions.items())
+        signature = _signatures.get(key)
+    except TypeError:
+        return _Signature(needs, conditions)
+    if signature is None:
+        signature = _signatures[key] = _Signature(needs, conditions)
+    return signature
+
+class _Signature(object):
+    def __init__(self, needs, conditions):
+        super(_Signature, self).__init__()
         self.needs = needs
-        self.parameters = parameters
-        self.returns = returns
         self.conditions = conditions
 
     def matches(self, event):
@@ -248,18 +545,221 @@ class _Hook(object):
             return False
         return True
 
-    def execute(self, pangler, event):
-        relevant = dict(
-            (key, value)
-            for key, value in event.iteritems()
-            if key in self.parameters)
+class _Matcher(object):
+    """Match hooks against one event.
+
+    Hooks with the same signature will match or not match together, so each
+    signature is only checked once until `changed` is called to say that a
+    hook changed some of the parameters it needs.
+
+    """
+
+    def __init__(self, event):
+        super(_Matcher, self).__init__()
+        self.event = event
+        self.matched = {}
+
+    def matches(self, hook):
+        signature = hook.signature
+        if signature is None:
+            signature = hook.prepare()
+        matched = self.matched
+        if signature in matched:
+            return matched[signature]
+        result = matched[signature] = signature.matches(self.event)
+        return result
+
+    def changed(self, keys):
+        matched = self.matched
+        for signature in list(matched):
+            if not signature.needs.isdisjoint(keys):
+                del matched[signature]
+
+class EventSchema(object):
+    """A fixed shape for events with a particular name.
+
+    An EventSchema declares every parameter an event named `event` can have,
+    once. Records made from it store their parameters in a list by position,
+    to be triggered with `Pangler.trigger_record`. The `event` parameter of
+    every record is always the schema's `event`, and can't be changed.
+
+    """
+
+    def __init__(self, event, fields):
+        super(EventSchema, self).__init__()
+        self.event = event
+        self.fields = ('event',) + tuple(
+            [field for field in fields if field != 'event'])
+        self.indices = dict(
+            (field, index) for index, field in enumerate(self.fields))
+
+    def record(self, **parameters):
+        """Make a new EventRecord from some parameters.
+
+        Records can be reused for several events by changing their
+        parameters in between.
+
+        """
+
+        values = [_MISSING] * len(self.fields)
+        values[0] = self.event
+        record = EventRecord(self, values)
+        for key in parameters:
+            record[key] = parameters[key]
+        return record
+
+class EventRecord(object):
+    """An event with the shape of an EventSchema.
+
+    Parameters can be fetched, set and tested for like with a dict, but only
+    parameters declared in the schema can be set.
+
+    """
+
+    __slots__ = ('schema', 'values')
+
+    def __init__(self, schema, values):
+        self.schema = schema
+        self.values = values
+
+    def __getitem__(self, key):
+        value = self.values[self.schema.indices[key]]
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        index = self.schema.indices.get(key)
+        if index is None:
+            raise ValueError("%r isn't in the schema" % (key,))
+        if index == 0:
+            raise ValueError("can't change the event of a record")
+        self.values[index] = value
+
+    def __delitem__(self, key):
+        self[key] = _MISSING
+
+    def __contains__(self, key):
+        index = self.schema.indices.get(key)
+        return index is not None and self.values[index] is not _MISSING
+
+    def as_dict(self):
+        """Return the parameters of this record as a dict."""
+
+        return dict(
+            (field, value)
+            for field, value in zip(self.schema.fields, self.values)
+            if value is not _MISSING)
+
+class _Hook(object):
+    def __init__(self, func, needs, returns, modifies, conditions,
+            timeout=None, critical=False):
+        super(_Hook, self).__init__()
+        self.func = func
+        self.declared = needs, returns, modifies
+        self.conditions = conditions
+        self.timeout = timeout
+        self.critical = critical
+        self.signature = None
+
+    def prepare(self):
+        if self.signature is not None:
+            return self.signature
+        needs, returns, modifies = self.declared
+        modifies = set(modifies)
+        self.parameters = set(needs) | modifies
+        self.needs = self.parameters | set(self.conditions)
+        if not self.needs:
+            raise ValueError("tried to hook nothing")
+        self.returns = set(returns) | modifies
+        self.signature = _signature(self.needs, self.conditions)
+        return self.signature
+
+    def fits(self, remaining):
+        if remaining <= 0:
+            return False
+        return self.timeout is None or self.timeout <= remaining
+
+    def call_args(self, pangler):
         # Pass the bound instance as the first argument, i.e. self.
         if pangler.instance is not None:
-            if pangler.instance() is None:
+            instance = pangler.instance()
+            if instance is None:
                 raise InstanceDead()
-            args = pangler.instance(), pangler
-        else:
-            args = pangler,
-        result = self.func(*args, **relevant)
+            return instance, pangler
+        return pangler,
+
+    def execute(self, pangler, event):
+        relevant = dict((key, event[key]) for key in self.parameters)
+        result = self.func(*self.call_args(pangler), **relevant)
         if result is not None:
             event.update(result)
+        return result
+
+    def positional_parameters(self, pangler):
+        """Find the order to pass parameters positionally, if possible.
+
+        Returns None if the parameters have to be passed as keyword arguments.
+
+        """
+
+        func = self.func
+        if pangler.instance is None:
+            skip = 1
+        else:
+            skip = 2
+        if inspect.ismethod(func):
+            if func.__self__ is not None:
+                skip += 1
+            func = func.__func__
+        if not inspect.isfunction(func):
+            return None
+        names = _getargspec(func)[0][skip:skip + len(self.parameters)]
+        if set(names) != self.parameters:
+            return None
+        return names
+
+    def plan(self, pangler, schema):
+        """Resolve this hook against an EventSchema.
+
+        Returns None if this hook can never match events of the schema.
+
+        """
+
+        self.prepare()
+        indices = schema.indices
+        for key in self.needs:
+            if key not in indices:
+                return None
+        conditions = []
+        for key in self.conditions:
+            if key == 'event':
+                if not self.conditions[key] == schema.event:
+                    return None
+            else:
+                conditions.append((indices[key], self.conditions[key]))
+        for key in self.returns:
+            if key not in indices or key == 'event':
+                raise ValueError(
+                    "%r can't be returned in records of %r" % (
+                        key, schema.event))
+        needs = tuple([indices[key] for key in self.needs])
+        names = self.positional_parameters(pangler)
+        if names is None:
+            arguments = tuple([(key, indices[key]) for key in self.parameters])
+            return self, needs, tuple(conditions), arguments, False
+        arguments = tuple([indices[key] for key in names])
+        return self, needs, tuple(conditions), arguments, True
+
+    def execute_record(self, pangler, record, arguments, positional):
+        values = record.values
+        if positional:
+            result = self.func(*(self.call_args(pangler) + tuple(
+                [values[index] for index in arguments])))
+        else:
+            relevant = dict(
+                (key, values[index]) for key, index in arguments)
+            result = self.func(*self.call_args(pangler), **relevant)
+        if result is not None:
+            for key in result:
+                record[key] = result[key]
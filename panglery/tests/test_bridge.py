@@ -0,0 +1,207 @@
+import multiprocessing
+import socket
+import unittest
+import panglery
+import panglery.bridge
+
+def _serve_child(publisher_end, connection, results):
+    # The publisher's end was inherited when forking, and has to be closed
+    # here for the subscriber to see the connection close.
+    publisher_end.close()
+    p = panglery.Pangler()
+
+    @p.subscribe(event='invalidate', needs=['key'])
+    def invalidate_hook(p, key):
+        results.send(key)
+
+    @p.subscribe(event='fail')
+    def error_hook(p):
+        raise ZeroDivisionError()
+
+    subscriber = panglery.bridge.EventSubscriber(connection, p)
+    subscriber.serve(
+        on_error=lambda e: results.send(e.__class__.__name__))
+    results.send(subscriber.stats.failed)
+    results.close()
+
+class _BridgeTests(object):
+    def setUp(self):
+        self.publisher_end, self.subscriber_end = self.make_connections()
+
+    def tearDown(self):
+        self.publisher_end.close()
+        self.subscriber_end.close()
+
+    def test_forwarding(self):
+        p = panglery.Pangler()
+        publisher = panglery.bridge.EventPublisher(
+            self.publisher_end, batch_size=2)
+        publisher.forward(p, needs=['key'], event='invalidate')
+
+        remote = panglery.Pangler()
+        subscriber = panglery.bridge.EventSubscriber(
+            self.subscriber_end, remote)
+        self.keys = []
+
+        @remote.subscribe(event='invalidate', needs=['key'])
+        def invalidate_hook(p, key):
+            self.keys.append(key)
+
+        p.trigger(event='invalidate', key='spam', unrelated=object())
+        p.trigger(event='unrelated', key='ham')
+        self.assertEqual(subscriber.receive(0), 0)
+        p.trigger(event='invalidate', key='eggs')
+        self.assertEqual(subscriber.receive(1), 2)
+        self.assertEqual(self.keys, ['spam', 'eggs'])
+
+        publisher.flush()
+        self.assertEqual(publisher.stats.events, 2)
+        self.assertEqual(publisher.stats.batches, 1)
+        self.assertEqual(publisher.stats.acked, 1)
+        self.assertEqual(subscriber.stats.events, 2)
+        self.assertEqual(subscriber.stats.bytes, publisher.stats.bytes)
+
+    def test_mixed_batch(self):
+        publisher = panglery.bridge.EventPublisher(self.publisher_end)
+        remote = panglery.Pangler()
+        subscriber = panglery.bridge.EventSubscriber(
+            self.subscriber_end, remote)
+        self.events = []
+
+        @remote.subscribe(needs=['event'])
+        def event_hook(p, event):
+            self.events.append(event)
+
+        publisher.publish(event='a', foo=1)
+        publisher.publish(event='b')
+        publisher.publish(event='c', foo=2)
+        publisher.flush()
+        self.assertEqual(subscriber.receive(1), 3)
+        self.assertEqual(self.events, ['a', 'b', 'c'])
+
+    def test_publishing_nothing(self):
+        publisher = panglery.bridge.EventPublisher(self.publisher_end)
+        self.assertRaises(ValueError, publisher.publish)
+
+    def test_backpressure(self):
+        publisher = panglery.bridge.EventPublisher(
+            self.publisher_end, batch_size=1, max_in_flight=1)
+        subscriber = panglery.bridge.EventSubscriber(
+            self.subscriber_end, panglery.Pangler())
+
+        publisher.publish(event='a')
+        self.assertEqual(publisher.in_flight, 1)
+        self.assertEqual(subscriber.receive(1), 1)
+        publisher.publish(event='b')
+        self.assertEqual(publisher.in_flight, 1)
+        self.assertEqual(publisher.stats.acked, 1)
+        self.assertEqual(publisher.stats.waits, 0)
+
+        subscriber.receive(1)
+        publisher.connection = _SlowAcks(self.publisher_end)
+        publisher.publish(event='c')
+        self.assertEqual(publisher.stats.waits, 1)
+        self.assertEqual(publisher.stats.acked, 2)
+
+    def test_ack_timeout(self):
+        publisher = panglery.bridge.EventPublisher(
+            self.publisher_end, batch_size=1, max_in_flight=1, ack_timeout=0)
+        publisher.publish(event='a')
+        self.assertRaises(
+            panglery.bridge.BridgeTimeout, publisher.publish, event='b')
+
+    def test_unserializable_events(self):
+        publisher = panglery.bridge.EventPublisher(self.publisher_end)
+        remote = panglery.Pangler()
+        subscriber = panglery.bridge.EventSubscriber(
+            self.subscriber_end, remote)
+        self.events = []
+
+        @remote.subscribe(needs=['event'])
+        def event_hook(p, event):
+            self.events.append(event)
+
+        publisher.publish(event='a')
+        publisher.publish(event='b', foo=lambda: None)
+        publisher.publish(event='c')
+        publisher.flush()
+        self.assertEqual(publisher.stats.dropped, 1)
+        self.assertEqual(publisher.stats.events, 2)
+        self.assertEqual(subscriber.receive(1), 2)
+        self.assertEqual(self.events, ['a', 'c'])
+
+        publisher.publish(event='d', foo=lambda: None)
+        publisher.flush()
+        self.assertEqual(publisher.stats.dropped, 2)
+        self.assertEqual(publisher.pending, [])
+        publisher.publish(event='e')
+        publisher.flush()
+        self.assertEqual(subscriber.receive(1), 1)
+        self.assertEqual(self.events, ['a', 'c', 'e'])
+
+    def test_failing_hooks(self):
+        publisher = panglery.bridge.EventPublisher(self.publisher_end)
+        remote = panglery.Pangler()
+        subscriber = panglery.bridge.EventSubscriber(
+            self.subscriber_end, remote)
+
+        @remote.subscribe(event='a')
+        def error_hook(p):
+            raise ZeroDivisionError()
+
+        publisher.publish(event='a')
+        publisher.publish(event='b')
+        publisher.flush()
+        self.assertRaises(ZeroDivisionError, subscriber.receive, 1)
+        self.assertEqual(subscriber.stats.failed, 1)
+        self.assertEqual(subscriber.stats.events, 0)
+        publisher.flush()
+        self.assertEqual(publisher.in_flight, 0)
+
+class _SlowAcks(object):
+    """A connection whose acknowledgements are never ready without waiting."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def poll(self, timeout=0):
+        return timeout != 0 and self.connection.poll(timeout)
+
+    def send_bytes(self, data):
+        self.connection.send_bytes(data)
+
+    def recv_bytes(self):
+        return self.connection.recv_bytes()
+
+class TestPipeBridge(_BridgeTests, unittest.TestCase):
+    def make_connections(self):
+        return multiprocessing.Pipe()
+
+class TestSocketBridge(_BridgeTests, unittest.TestCase):
+    def make_connections(self):
+        a, b = socket.socketpair()
+        return (panglery.bridge.SocketConnection(a),
+            panglery.bridge.SocketConnection(b))
+
+class TestProcessBridge(unittest.TestCase):
+    def test_child_process(self):
+        publisher_end, subscriber_end = multiprocessing.Pipe()
+        results_recv, results_send = multiprocessing.Pipe(False)
+        child = multiprocessing.Process(target=_serve_child,
+            args=(publisher_end, subscriber_end, results_send))
+        child.start()
+        subscriber_end.close()
+        results_send.close()
+
+        publisher = panglery.bridge.EventPublisher(publisher_end)
+        publisher.publish(event='invalidate', key='spam')
+        publisher.flush()
+        publisher.publish(event='fail')
+        publisher.flush()
+        publisher.publish(event='invalidate', key='eggs')
+        publisher.close()
+        for result in ['spam', 'ZeroDivisionError', 'eggs', 1]:
+            self.assert_(results_recv.poll(5), 'the child sent nothing')
+            self.assertEqual(results_recv.recv(), result)
+        child.join(5)
+        self.assertEqual(child.exitcode, 0)
@@ -1,5 +1,7 @@
+import gc
 import unittest
 import panglery.pangler
+import weakref
 
 class TestPangler(unittest.TestCase):
     def test_basic_event(self):
@@ -198,6 +200,522 @@ class TestPangler(unittest.TestCase):
         p3.trigger(event='test')
         self.assertEqual(self.fired, 3)
 
+    def test_combining_deduplicates(self):
+        self.fired = 0
+
+        p = panglery.Pangler()
+        @p.subscribe(event='test')
+        def test_hook(p):
+            self.fired += 1
+
+        p2 = p.combine(p, p.clone())
+        self.assertEqual(len(p2.hooks), 1)
+        p2.trigger(event='test')
+        self.assertEqual(self.fired, 1)
+
+    def test_signatures_matched_once(self):
+        class Condition(object):
+            comparisons = 0
+            def __eq__(self, other):
+                Condition.comparisons += 1
+                return other is self
+            def __hash__(self):
+                return 0
+
+        p = panglery.Pangler()
+        p2 = panglery.Pangler()
+        condition = Condition()
+        self.fired = 0
+
+        def test_hook(p, foo):
+            self.fired += 1
+        p.subscribe(test_hook, needs=['foo'], event=condition)
+        p.subscribe(test_hook, needs=['foo'], event=condition)
+        p2.subscribe(test_hook, needs=['foo'], event=condition)
+
+        p.combine(p2).trigger(event=condition, foo=1)
+        self.assertEqual(self.fired, 3)
+        self.assertEqual(Condition.comparisons, 1)
+
+    def test_signatures_rematched_after_modification(self):
+        p = panglery.Pangler()
+        self.fired = 0
+
+        @p.subscribe(foo=1, returns=['foo'])
+        def test_hook(p):
+            self.fired |= 1
+            return {'foo': 2}
+
+        @p.subscribe(foo=1)
+        def test_hook2(p):
+            self.fired |= 2
+
+        p.trigger(foo=1)
+        self.assertEqual(self.fired, 1)
+
+    def test_signatures_rematched_only_when_needed(self):
+        class Condition(object):
+            comparisons = 0
+            def __eq__(self, other):
+                Condition.comparisons += 1
+                return other is self
+            def __hash__(self):
+                return 0
+
+        p = panglery.Pangler()
+        condition = Condition()
+
+        @p.subscribe(event=condition, returns=['bar'])
+        def test_hook(p):
+            return {'bar': 1}
+
+        @p.subscribe(event=condition)
+        def test_hook2(p):
+            return {}
+
+        @p.subscribe(event=condition, returns=['event'])
+        def test_hook3(p):
+            return {'event': condition}
+
+        @p.subscribe(event=condition)
+        def test_hook4(p):
+            pass
+
+        p.trigger(event=condition)
+        self.assertEqual(Condition.comparisons, 2)
+        Condition.comparisons = 0
+        list(p.trigger_iter(event=condition))
+        self.assertEqual(Condition.comparisons, 2)
+
+    def test_trigger_iter(self):
+        p = panglery.Pangler()
+
+        @p.subscribe(modifies=['foo'])
+        def foo_hook(p, foo):
+            return {'foo': foo * 2}
+
+        @p.subscribe(needs=['foo'])
+        def foo_hook2(p, foo):
+            pass
+
+        @p.subscribe(needs=['bar'])
+        def bar_hook(p, bar):
+            pass
+
+        self.assertEqual(
+            list(p.trigger_iter(foo=3)),
+            [(foo_hook, {'foo': 6}), (foo_hook2, {})])
+
+    def test_trigger_iter_stopping(self):
+        p = panglery.Pangler()
+        self.fired = 0
+
+        @p.subscribe(needs=['foo'])
+        def foo_hook(p, foo):
+            self.fired |= 1
+
+        @p.subscribe(needs=['foo'])
+        def foo_hook2(p, foo):
+            self.fired |= 2
+
+        hooks = p.trigger_iter(foo=3)
+        self.assertEqual(self.fired, 0)
+        self.assertEqual(next(hooks), (foo_hook, {}))
+        self.assertEqual(self.fired, 1)
+        del hooks
+        self.assertEqual(self.fired, 1)
+
+    def test_trigger_iter_nothing(self):
+        p = panglery.Pangler()
+        self.assertRaises(ValueError, p.trigger_iter)
+
+    def test_overlay(self):
+        p = panglery.Pangler()
+        self.fired = []
+
+        @p.subscribe(event='test')
+        def test_hook(p):
+            self.fired.append(1)
+
+        p2 = p.overlay()
+        self.assert_(p2.base is p)
+        self.assertEqual(p2.hooks, [])
+
+        @p2.subscribe(event='test')
+        def test_hook2(p):
+            self.fired.append(2)
+
+        @p.subscribe(event='test')
+        def test_hook3(p):
+            self.fired.append(3)
+
+        p2.trigger(event='test')
+        self.assertEqual(self.fired, [1, 3, 2])
+        self.fired = []
+        p.trigger(event='test')
+        self.assertEqual(self.fired, [1, 3])
+
+    def test_overlay_records_see_base_hooks(self):
+        p = panglery.Pangler()
+        schema = panglery.EventSchema('test', ['foo'])
+        self.fired = []
+
+        @p.subscribe(needs=['foo'])
+        def test_hook(p, foo):
+            self.fired.append(1)
+
+        p2 = p.overlay()
+        p2.trigger_record(schema.record(foo=1))
+        self.assertEqual(self.fired, [1])
+
+        @p.subscribe(needs=['foo'])
+        def test_hook2(p, foo):
+            self.fired.append(2)
+
+        self.fired = []
+        p2.trigger_record(schema.record(foo=1))
+        self.assertEqual(self.fired, [1, 2])
+
+    def test_overlay_prepared_plans_see_base_hooks(self):
+        p = panglery.Pangler()
+        schema = panglery.EventSchema('test', ['foo'])
+        p2 = p.overlay().overlay()
+        p2.prepare(schema)
+        self.fired = False
+
+        @p.subscribe(needs=['foo'])
+        def test_hook(p, foo):
+            self.fired = True
+
+        p2.trigger_record(schema.record(foo=1))
+        self.assert_(self.fired)
+
+    def test_combining_overlays(self):
+        p = panglery.Pangler()
+        self.fired = 0
+
+        @p.subscribe(event='test')
+        def test_hook(p):
+            self.fired |= 1
+
+        p2 = p.overlay()
+        @p2.subscribe(event='test')
+        def test_hook2(p):
+            self.fired |= 2
+
+        p3 = panglery.Pangler().combine(p2, p)
+        self.assertEqual(len(p3.hooks), 2)
+        p3.trigger(event='test')
+        self.assertEqual(self.fired, 3)
+
+    def test_no_report_without_deadline(self):
+        p = panglery.Pangler()
+        self.assertEqual(p.trigger(event='test'), None)
+
+    def test_deadline_skipping(self):
+        p = panglery.Pangler()
+        self.fired = 0
+
+        @p.subscribe(event='test')
+        def test_hook(p):
+            self.fired |= 1
+
+        @p.subscribe(event='test', _critical=True)
+        def test_hook2(p):
+            self.fired |= 2
+
+        report = p.trigger(event='test', _deadline=0)
+        self.assertEqual(self.fired, 2)
+        self.assertEqual(report.skipped, [test_hook])
+        self.assertEqual(report.deferred, [])
+
+    def test_deadline_timeouts(self):
+        p = panglery.Pangler()
+        self.fired = 0
+
+        @p.subscribe(event='test', _timeout=60)
+        def test_hook(p):
+            self.fired |= 1
+
+        @p.subscribe(event='test', _timeout=0.001)
+        def test_hook2(p):
+            self.fired |= 2
+
+        @p.subscribe(event='test')
+        def test_hook3(p):
+            self.fired |= 4
+
+        report = p.trigger(event='test', _deadline=30)
+        self.assertEqual(self.fired, 6)
+        self.assertEqual(report.skipped, [test_hook])
+
+    def test_deadline_clock(self):
+        now = [100]
+        p = panglery.Pangler()
+        self.fired = 0
+
+        @p.subscribe(event='test')
+        def test_hook(p):
+            self.fired |= 1
+            now[0] += 10
+
+        @p.subscribe(event='test')
+        def test_hook2(p):
+            self.fired |= 2
+
+        clock = panglery.pangler._clock
+        panglery.pangler._clock = lambda: now[0]
+        try:
+            report = p.trigger(event='test', _deadline=5)
+        finally:
+            panglery.pangler._clock = clock
+        self.assertEqual(self.fired, 1)
+        self.assertEqual(report.skipped, [test_hook2])
+
+    def test_executor_without_deadline(self):
+        p = panglery.Pangler()
+        self.assertRaises(
+            ValueError, p.trigger, event='test', _executor=object())
+
+    def test_deadline_deferring(self):
+        class FakeExecutor(object):
+            def __init__(self):
+                self.submitted = []
+            def submit(self, func, *a, **kw):
+                self.submitted.append((func, a, kw))
+
+        p = panglery.Pangler()
+        self.fired = False
+
+        @p.subscribe(needs=['foo'])
+        def foo_hook(p, foo):
+            self.fired = True
+
+        executor = FakeExecutor()
+        report = p.trigger(foo=3, _deadline=0, _executor=executor)
+        self.assertFalse(self.fired)
+        self.assertEqual(report.skipped, [])
+        self.assertEqual(report.deferred, [foo_hook])
+        [(func, a, kw)] = executor.submitted
+        func(*a, **kw)
+        self.assert_(self.fired)
+
+class TestLazyPangler(unittest.TestCase):
+    def test_lazy_subscription(self):
+        p = panglery.Pangler(lazy=True)
+        self.fired = False
+
+        @p.subscribe(event='test', needs=['foo'])
+        def test_hook(p, foo):
+            self.assertEqual(foo, 1)
+            self.fired = True
+
+        [hook] = p.hooks
+        self.assertEqual(hook.signature, None)
+        p.trigger(event='test', foo=1)
+        self.assert_(self.fired)
+        self.assertNotEqual(hook.signature, None)
+
+    def test_lazy_hooking_nothing(self):
+        p = panglery.Pangler(lazy=True)
+        self.assertRaises(ValueError, p.subscribe, lambda: None)
+
+    def test_lazy_default(self):
+        class LazyPangler(panglery.Pangler):
+            lazy = True
+
+        self.assert_(LazyPangler().lazy)
+        self.assert_(LazyPangler().clone().lazy)
+        self.assertFalse(LazyPangler(lazy=False).lazy)
+        self.assertFalse(panglery.Pangler().lazy)
+
+    def test_prepare(self):
+        p = panglery.Pangler(lazy=True)
+        schema = panglery.EventSchema('test', ['foo'])
+        self.fired = False
+
+        @p.subscribe(event='test', needs=['foo'])
+        def test_hook(p, foo):
+            self.fired = True
+
+        p.prepare(schema)
+        [hook] = p.hooks
+        self.assertNotEqual(hook.signature, None)
+        p.trigger_record(schema.record(foo=1))
+        self.assert_(self.fired)
+
+    def test_lazy_aggregate(self):
+        self.fired = 0
+
+        class TestClassA(object):
+            hooks = panglery.Pangler(lazy=True)
+            p = panglery.PanglerAggregate('hooks')
+
+            @hooks.subscribe(event='test')
+            def test_hookA(_, p):
+                self.fired |= 1
+
+        class TestClassB(TestClassA):
+            hooks = panglery.Pangler(lazy=True)
+
+            @hooks.subscribe(event='test')
+            def test_hookB(_, p):
+                self.fired |= 2
+
+        inst = TestClassB()
+        inst.p().trigger(event='test')
+        self.assertEqual(self.fired, 3)
+
+class TestEventRecords(unittest.TestCase):
+    def setUp(self):
+        self.schema = panglery.EventSchema('test', ['foo', 'bar'])
+
+    def test_record_parameters(self):
+        record = self.schema.record(foo=1)
+        self.assertEqual(record['event'], 'test')
+        self.assertEqual(record['foo'], 1)
+        self.assert_('foo' in record)
+        self.assert_('bar' not in record)
+        self.assert_('spam' not in record)
+        self.assertRaises(KeyError, lambda: record['bar'])
+        self.assertRaises(ValueError, record.__setitem__, 'spam', 1)
+        self.assertRaises(ValueError, record.__setitem__, 'event', 'test2')
+        del record['foo']
+        self.assertEqual(record.as_dict(), {'event': 'test'})
+
+    def test_triggering_records(self):
+        p = panglery.Pangler()
+        self.fired = 0
+
+        @p.subscribe(event='test', modifies=['foo'])
+        def foo_hook(p, foo):
+            self.fired |= 1
+            return {'foo': foo * 2}
+
+        @p.subscribe(needs=['foo'], returns=['bar'])
+        def bar_hook(p, foo):
+            self.fired |= 2
+            return {'bar': foo + 1}
+
+        @p.subscribe(event='test2', needs=['foo'])
+        def unrelated_hook(p, foo):
+            self.fired |= 4
+
+        @p.subscribe(needs=['spam'])
+        def spam_hook(p, spam):
+            self.fired |= 8
+
+        record = self.schema.record(foo=3)
+        p.trigger_record(record)
+        self.assertEqual(self.fired, 3)
+        self.assertEqual(
+            record.as_dict(), {'event': 'test', 'foo': 6, 'bar': 7})
+
+    def test_record_conditions(self):
+        p = panglery.Pangler()
+        self.fired = False
+
+        @p.subscribe(foo=1)
+        def foo_hook(p):
+            self.fired = True
+
+        p.trigger_record(self.schema.record(foo=2))
+        p.trigger_record(self.schema.record())
+        self.assertFalse(self.fired)
+        p.trigger_record(self.schema.record(foo=1))
+        self.assert_(self.fired)
+
+    def test_record_conditions_use_equality(self):
+        class Condition(object):
+            def __eq__(self, other):
+                return True
+
+        p = panglery.Pangler()
+        self.fired = 0
+
+        @p.subscribe(foo=Condition())
+        def foo_hook(p):
+            self.fired += 1
+
+        @p.subscribe(event=Condition(), needs=['foo'])
+        def foo_hook2(p, foo):
+            self.fired += 1
+
+        p.trigger_record(self.schema.record(foo=1))
+        self.assertEqual(self.fired, 2)
+        p.trigger_record(self.schema.record())
+        self.assertEqual(self.fired, 2)
+
+    def test_record_returns_checked(self):
+        p = panglery.Pangler()
+        self.fired = False
+
+        @p.subscribe(needs=['foo'])
+        def foo_hook(p, foo):
+            self.fired = True
+
+        @p.subscribe(needs=['foo'], returns=['spam'])
+        def spam_hook(p, foo):
+            return {'spam': foo}
+
+        @p.subscribe(event='test2', returns=['spam'])
+        def unrelated_hook(p):
+            return {'spam': 1}
+
+        record = self.schema.record(foo=1)
+        self.assertRaises(ValueError, p.trigger_record, record)
+        self.assertFalse(self.fired)
+        del p.hooks[1]
+
+        @p.subscribe(needs=['foo'], returns=['event'])
+        def event_hook(p, foo):
+            return {'event': 'test2'}
+
+        self.assertRaises(ValueError, p.trigger_record, record)
+        self.assertFalse(self.fired)
+
+    def test_record_keyword_parameters(self):
+        p = panglery.Pangler()
+        self.fired = False
+
+        @p.subscribe(needs=['foo', 'bar'])
+        def foo_hook(p, **kw):
+            self.assertEqual(kw, {'foo': 1, 'bar': 2})
+            self.fired = True
+
+        p.trigger_record(self.schema.record(foo=1, bar=2))
+        self.assert_(self.fired)
+
+    def test_record_binding(self):
+        self.fired = False
+        class TestClass(object):
+            p = panglery.Pangler()
+
+            @p.subscribe(needs=['bar', 'foo'])
+            def test_hook(self2, p, foo, bar):
+                self.assertEqual((foo, bar), (1, 2))
+                self.fired = True
+
+        inst = TestClass()
+        inst.p.trigger_record(self.schema.record(foo=1, bar=2))
+        self.assert_(self.fired)
+
+    def test_record_plans_updated(self):
+        p = panglery.Pangler()
+        self.fired = 0
+        p.trigger_record(self.schema.record(foo=1))
+
+        @p.subscribe(needs=['foo'])
+        def foo_hook(p, foo):
+            self.fired += 1
+
+        p.trigger_record(self.schema.record(foo=1))
+        self.assertEqual(self.fired, 1)
+
+        p.hooks[:] = []
+        p.trigger_record(self.schema.record(foo=1))
+        self.assertEqual(self.fired, 1)
+
 class TestPanglerAggregate(unittest.TestCase):
     def test_subclass_binding(self):
         self.fired = 0
@@ -240,6 +758,143 @@ class TestPanglerAggregate(unittest.TestCase):
         inst.p().trigger(event='test')
         self.assertEqual(self.fired, 3)
 
+    def test_inherited_pangler_aggregated_once(self):
+        self.fired = 0
+
+        class TestClassA(object):
+            hooks = panglery.Pangler()
+            p = panglery.PanglerAggregate('hooks')
+
+            @hooks.subscribe(event='test')
+            def test_hookA(_, p):
+                self.fired += 1
+
+        class TestClassB(TestClassA):
+            pass
+
+        inst = TestClassB()
+        inst.p().trigger(event='test')
+        self.assertEqual(self.fired, 1)
+
+    def test_instance_overlays(self):
+        self.fired = []
+
+        class TestClass(object):
+            hooks = panglery.Pangler()
+            p = panglery.PanglerAggregate('hooks')
+
+            @hooks.subscribe(event='test')
+            def test_hook(_, p):
+                self.fired.append(1)
+
+        inst = TestClass()
+        inst2 = TestClass()
+        p = inst.p()
+        self.assertEqual(p.hooks, [])
+        self.assert_(p.base is inst2.p().base)
+
+        @p.subscribe(event='test')
+        def test_hook2(_, p):
+            self.fired.append(2)
+
+        p.trigger(event='test')
+        self.assertEqual(self.fired, [1, 2])
+        self.fired = []
+        inst2.p().trigger(event='test')
+        self.assertEqual(self.fired, [1])
+
+    def test_aggregate_sees_new_hooks(self):
+        self.fired = 0
+
+        class TestClass(object):
+            hooks = panglery.Pangler()
+            p = panglery.PanglerAggregate('hooks')
+
+            @hooks.subscribe(event='test')
+            def test_hook(_, p):
+                self.fired |= 1
+
+        inst = TestClass()
+        base = inst.p().base
+
+        @TestClass.hooks.subscribe(event='test')
+        def test_hook2(_, p):
+            self.fired |= 2
+
+        inst2 = TestClass()
+        self.assert_(inst2.p().base is not base)
+        inst2.p().trigger(event='test')
+        self.assertEqual(self.fired, 3)
+
+    def test_aggregate_sees_replaced_hooks(self):
+        self.fired = 0
+
+        class TestClass(object):
+            hooks = panglery.Pangler()
+            p = panglery.PanglerAggregate('hooks')
+
+            @hooks.subscribe(event='test')
+            def test_hook(_, p):
+                self.fired |= 1
+
+        inst = TestClass()
+        inst.p().trigger(event='test')
+        self.assertEqual(self.fired, 1)
+
+        TestClass.hooks.hooks.pop()
+        @TestClass.hooks.subscribe(event='test')
+        def test_hook2(_, p):
+            self.fired |= 2
+
+        self.fired = 0
+        inst2 = TestClass()
+        inst2.p().trigger(event='test')
+        self.assertEqual(self.fired, 2)
+
+    def test_aggregate_sees_removed_hooks(self):
+        self.fired = 0
+
+        class TestClassA(object):
+            hooks = panglery.Pangler()
+            p = panglery.PanglerAggregate('hooks')
+
+            @hooks.subscribe(event='test')
+            def test_hook(_, p):
+                self.fired += 1
+
+        class TestClassB(TestClassA):
+            hooks = TestClassA.hooks.overlay()
+
+        inst = TestClassB()
+        inst.p().trigger(event='test')
+        self.assertEqual(self.fired, 1)
+
+        del TestClassA.hooks.hooks[:]
+        inst2 = TestClassB()
+        inst2.p().trigger(event='test')
+        self.assertEqual(self.fired, 1)
+
+    def test_aggregate_classes_collected(self):
+        class TestBase(object):
+            p = panglery.PanglerAggregate('hooks')
+
+        def make_class():
+            class TestClass(TestBase):
+                hooks = panglery.Pangler()
+
+                @hooks.subscribe(event='test')
+                def test_hook(_, p):
+                    # Refer to the class, like super() does.
+                    TestClass
+
+            inst = TestClass()
+            inst.p().trigger(event='test')
+            return weakref.ref(TestClass)
+
+        ref = make_class()
+        gc.collect()
+        self.assertEqual(ref(), None)
+
     def test_unbound_aggregate(self):
         agg = panglery.PanglerAggregate()
         class TestClass(object):
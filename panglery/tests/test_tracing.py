@@ -0,0 +1,179 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import panglery
+import panglery.tracing
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+class ListExporter(object):
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.p = panglery.Pangler()
+
+        @self.p.subscribe(modifies=['foo'])
+        def foo_hook(p, foo):
+            return {'foo': foo * 2}
+
+        @self.p.subscribe(needs=['foo'])
+        def foo_hook2(p, foo):
+            pass
+
+        @self.p.subscribe(needs=['bar'])
+        def bar_hook(p, bar):
+            pass
+
+    def test_requires_sampling(self):
+        self.assertRaises(ValueError, panglery.tracing.Tracer)
+        self.assertRaises(
+            ValueError, panglery.tracing.Tracer, every=1, fraction=0.5)
+
+    def test_sampling_ranges(self):
+        Tracer = panglery.tracing.Tracer
+        self.assertRaises(ValueError, Tracer, every=0)
+        self.assertRaises(ValueError, Tracer, every=-1)
+        self.assertRaises(ValueError, Tracer, fraction=-0.1)
+        self.assertRaises(ValueError, Tracer, fraction=1.5)
+        Tracer(fraction=0)
+        Tracer(fraction=1)
+
+    def test_every(self):
+        tracer = self.p.tracer = panglery.tracing.Tracer(every=3)
+        for foo in range(7):
+            self.p.trigger(foo=foo)
+        self.assertEqual(
+            [span.attributes['event'] for span in tracer.spans],
+            [{'foo': 2}, {'foo': 5}])
+
+    def test_fraction(self):
+        samples = iter([0.7, 0.2, 0.5, 0.1])
+        tracer = self.p.tracer = panglery.tracing.Tracer(
+            fraction=0.5, rng=lambda: next(samples))
+        for foo in range(4):
+            self.p.trigger(foo=foo)
+        self.assertEqual(
+            [span.attributes['event'] for span in tracer.spans],
+            [{'foo': 1}, {'foo': 3}])
+
+    def test_span_tree(self):
+        tracer = self.p.tracer = panglery.tracing.Tracer(
+            every=1, clock=FakeClock())
+        self.p.trigger(foo=3)
+        [span] = tracer.spans
+        self.assertEqual(span.name, 'trigger')
+        self.assertEqual(span.duration, 5)
+        self.assertEqual(span.attributes, {'event': {'foo': 3}})
+        first, second = span.children
+        self.assertEqual(first.name, 'foo_hook')
+        self.assertEqual(first.duration, 1)
+        self.assertEqual(
+            first.attributes, {'status': 'ran', 'delta': {'foo': 6}})
+        self.assertEqual(second.name, 'foo_hook2')
+        self.assertEqual(second.attributes, {'status': 'ran'})
+
+    def test_skipped_hooks(self):
+        tracer = self.p.tracer = panglery.tracing.Tracer(every=1)
+        self.p.trigger(foo=3, _deadline=0)
+        [span] = tracer.spans
+        self.assertEqual(
+            [child.attributes['status'] for child in span.children],
+            ['skipped', 'skipped'])
+
+    def test_hook_errors(self):
+        tracer = self.p.tracer = panglery.tracing.Tracer(every=1)
+
+        @self.p.subscribe(needs=['foo'])
+        def error_hook(p, foo):
+            raise ZeroDivisionError()
+
+        self.assertRaises(ZeroDivisionError, self.p.trigger, foo=3)
+        [span] = tracer.spans
+        self.assertNotEqual(span.end, None)
+        self.assertEqual(span.children[-1].attributes, {'status': 'error'})
+
+    def test_ring_buffer(self):
+        tracer = self.p.tracer = panglery.tracing.Tracer(every=1, capacity=2)
+        for foo in range(3):
+            self.p.trigger(foo=foo)
+        self.assertEqual(
+            [span.attributes['event'] for span in tracer.spans],
+            [{'foo': 1}, {'foo': 2}])
+
+    def test_flushing(self):
+        exporter = ListExporter()
+        tracer = self.p.tracer = panglery.tracing.Tracer(
+            every=1, exporter=exporter)
+        self.p.trigger(foo=3)
+        spans = list(tracer.spans)
+        self.assertEqual(tracer.flush(), spans)
+        self.assertEqual(exporter.spans, spans)
+        self.assertEqual(len(tracer.spans), 0)
+
+    def test_tracer_inherited(self):
+        tracer = panglery.tracing.Tracer(every=1)
+        class TestClass(object):
+            p = panglery.Pangler()
+            p.tracer = tracer
+
+            @p.subscribe(event='test')
+            def test_hook(self, p):
+                pass
+
+        inst = TestClass()
+        inst.p.trigger(event='test')
+        self.assertEqual(len(tracer.spans), 1)
+        self.assertEqual(panglery.Pangler().tracer, None)
+
+    def test_tracer_aggregated(self):
+        tracer = panglery.tracing.Tracer(every=1)
+        class TestClassA(object):
+            hooks = panglery.Pangler()
+            hooks.tracer = tracer
+            p = panglery.PanglerAggregate('hooks')
+
+            @hooks.subscribe(event='test')
+            def test_hook(self, p):
+                pass
+
+        class TestClassB(TestClassA):
+            hooks = panglery.Pangler()
+
+        inst = TestClassB()
+        inst.p().trigger(event='test')
+        [span] = tracer.spans
+        self.assertEqual(
+            [child.name for child in span.children], ['test_hook'])
+
+class TestFileExporter(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_export(self):
+        path = os.path.join(self.tempdir, 'spans.json')
+        exporter = panglery.tracing.FileExporter(path)
+        span = panglery.tracing.Span('trigger', 1, event={'foo': object()})
+        span.end = 3
+        exporter.export([span])
+        exporter.export([span])
+        lines = open(path).readlines()
+        self.assertEqual(len(lines), 2)
+        exported = json.loads(lines[0])
+        self.assertEqual(exported['duration'], 2)
+        self.assert_(exported['attributes']['event']['foo'].startswith('<'))
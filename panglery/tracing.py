@@ -0,0 +1,156 @@
+"""Sampled tracing of triggered events for panglery.
+
+A `Tracer` set as the `tracer` of a Pangler (or of every Pangler, as
+`Pangler.tracer`) records a span tree for a sample of the events triggered:
+one span for the event, with one child span per matched hook recording how
+long it took and what it changed. Finished spans are kept in a ring buffer
+until they're flushed to an exporter.
+
+"""
+
+import collections
+import json
+import random
+import time
+
+_clock = getattr(time, 'monotonic', time.time)
+
+class Span(object):
+    """A timed operation.
+
+    `attributes` describe the operation, and `children` are the spans of the
+    operations it was made of. `end` is None until the span is finished.
+
+    """
+
+    def __init__(self, name, start, **attributes):
+        super(Span, self).__init__()
+        self.name = name
+        self.start = start
+        self.end = None
+        self.attributes = attributes
+        self.children = []
+
+    @property
+    def duration(self):
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+    def as_dict(self):
+        """Return this span and its children as nested dicts."""
+
+        return {
+            'name': self.name,
+            'start': self.start,
+            'duration': self.duration,
+            'attributes': self.attributes,
+            'children': [child.as_dict() for child in self.children],
+        }
+
+class Tracer(object):
+    """A sampling tracer for Panglers.
+
+    Either every `every`th event is traced, or each event is traced with a
+    probability of `fraction`. At most `capacity` finished spans are kept;
+    past that, the oldest are dropped. `flush` passes the kept spans to
+    `exporter`, which can be anything with an `export` method taking a list of
+    spans. Times are read from `clock`, which defaults to a monotonic clock
+    where there is one.
+
+    """
+
+    def __init__(self, every=None, fraction=None, capacity=1024,
+            exporter=None, clock=_clock, rng=random.random):
+        super(Tracer, self).__init__()
+        if (every is None) == (fraction is None):
+            raise ValueError("exactly one of every or fraction is required")
+        if every is not None and every < 1:
+            raise ValueError("every must be at least 1")
+        if fraction is not None and not 0 <= fraction <= 1:
+            raise ValueError("fraction must be between 0 and 1")
+        self.every = every
+        self.fraction = fraction
+        self.exporter = exporter
+        self.clock = clock
+        self.rng = rng
+        self.spans = collections.deque(maxlen=capacity)
+        self.count = 0
+
+    def start(self, event):
+        """Start tracing an event, if it's sampled.
+
+        Returns the span for the event, or None if it isn't being traced.
+
+        """
+
+        self.count += 1
+        if self.every is not None:
+            if self.count % self.every:
+                return None
+        elif self.rng() >= self.fraction:
+            return None
+        return Span('trigger', self.clock(), event=dict(event))
+
+    def execute(self, span, hook, pangler, event):
+        """Execute a hook, recording it as a child of `span`."""
+
+        child = Span(_hook_name(hook), self.clock(), status='ran')
+        span.children.append(child)
+        try:
+            result = hook.execute(pangler, event)
+        except Exception:
+            child.end = self.clock()
+            child.attributes['status'] = 'error'
+            self.finish(span)
+            raise
+        child.end = self.clock()
+        if result is not None:
+            child.attributes['delta'] = dict(result)
+        return result
+
+    def skip(self, span, hook, status):
+        """Record that a hook matched but didn't run."""
+
+        now = self.clock()
+        child = Span(_hook_name(hook), now, status=status)
+        child.end = now
+        span.children.append(child)
+
+    def finish(self, span):
+        """Finish tracing an event."""
+
+        span.end = self.clock()
+        self.spans.append(span)
+
+    def flush(self):
+        """Pass every kept span to the exporter and forget them."""
+
+        spans = list(self.spans)
+        self.spans.clear()
+        if self.exporter is not None and spans:
+            self.exporter.export(spans)
+        return spans
+
+class FileExporter(object):
+    """Append spans to a file, one JSON object per line.
+
+    Values which can't be represented in JSON are written as their `repr`.
+
+    """
+
+    def __init__(self, path):
+        super(FileExporter, self).__init__()
+        self.path = path
+
+    def export(self, spans):
+        outfile = open(self.path, 'a')
+        try:
+            for span in spans:
+                outfile.write(json.dumps(span.as_dict(), default=repr))
+                outfile.write('\n')
+        finally:
+            outfile.close()
+
+def _hook_name(hook):
+    return getattr(hook.func, '__name__', None) or repr(hook.func)